@@ -3,20 +3,43 @@
 Sistema de Processamento de Dados com Vazamentos de Memória Intencionais
 Este programa simula um sistema complexo com múltiplos tipos de vazamentos
 para testar ferramentas de monitoramento de memória.
+
+Dependências: numpy (obrigatória); psutil (opcional, para o relatório de memória).
+Instale com: pip install -r requirements.txt
+
+Defina LEAK_TRACEMALLOC=1 para registrar periodicamente as linhas com maior
+crescimento de alocações (tracemalloc).
 """
 
 import threading
+import itertools
+import queue
 import time
-import json
 import random
 import string
 import logging
-from datetime import datetime
 from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, deque
 import weakref
 import gc
+import os
+import tracemalloc
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Alfabetos pré-calculados para geração de payloads
+_ALPHABET = np.frombuffer((string.ascii_letters + string.digits).encode(), dtype=np.uint8)
+_LETTERS = np.frombuffer(string.ascii_letters.encode(), dtype=np.uint8)
+
+def _random_text(k: int, alphabet: np.ndarray = _ALPHABET) -> bytes:
+    """Gera k caracteres aleatórios do alfabeto em uma única chamada vetorizada"""
+    return alphabet[np.random.randint(0, len(alphabet), k)].tobytes()
 
 # Configuração de logging
 logging.basicConfig(
@@ -25,65 +48,111 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class LRU(OrderedDict):
+    """Dicionário com capacidade limitada que descarta o item mais antigo.
+    
+    A ordem de descarte segue inserção/atualização: leituras não renovam o item.
+    
+    >>> c = LRU(maxsize=2)
+    >>> len(c), c.maxsize
+    (0, 2)
+    >>> c["a"] = 1; c["b"] = 2; c["a"] = 3; c["c"] = 4
+    >>> list(c.items())
+    [('a', 3), ('c', 4)]
+    """
+    def __init__(self, maxsize: int = 4096, *args, **kwargs):
+        self.maxsize = maxsize
+        super().__init__(*args, **kwargs)
+    
+    def copy(self):
+        return type(self)(self.maxsize, self)
+    
+    def __reduce__(self):
+        return type(self), (self.maxsize, list(self.items()))
+        
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super().__setitem__(key, value)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
 # Variáveis globais que causam vazamentos
-GLOBAL_CACHE = {}  # Vazamento 1: Cache que nunca é limpo
+GLOBAL_CACHE = LRU(maxsize=4096)  # Cache limitado: descarta os itens mais antigos
 EVENT_LISTENERS = []  # Vazamento 2: Listeners que se acumulam
-THREAD_POOL = []  # Vazamento 3: Threads que não são limpas adequadamente
+THREAD_POOL = weakref.WeakSet()  # Threads rastreadas sem impedir sua coleta
+TEMP_OBJECTS_PER_RECORD = 100  # Objetos temporários contabilizados por registro
+TRACEMALLOC_INTERVAL = 10  # Iterações entre relatórios de crescimento do tracemalloc
 
 @dataclass
 class DataRecord:
     """Classe para representar registros de dados"""
-    id: str
-    timestamp: datetime
+    # __slots__ manual (compatível com Python < 3.10); __weakref__ permite weakref.ref
+    __slots__ = ('id', 'timestamp', 'data', 'metadata', '_parent_ref', 'children', '__weakref__')
+    
+    id: int
+    timestamp: int  # time.monotonic_ns()
     data: Dict[str, Any]
     metadata: Dict[str, Any]
     
     def __post_init__(self):
-        # Vazamento 4: Referências circulares
-        self.parent = None
+        # Pai -> filhos é forte; filho -> pai é fraco, evitando ciclos
+        self._parent_ref = None
         self.children = []
+    
+    @property
+    def parent(self) -> Optional["DataRecord"]:
+        return self._parent_ref() if self._parent_ref is not None else None
+    
+    @parent.setter
+    def parent(self, p: Optional["DataRecord"]):
+        self._parent_ref = weakref.ref(p) if p is not None else None
 
 class EventListener:
     """Classe que simula listeners de eventos"""
     def __init__(self, name: str, callback):
         self.name = name
         self.callback = callback
-        self.data_buffer = []  # Vazamento 5: Buffer que cresce indefinidamente
+        self.data_buffer = deque(maxlen=1024)  # Buffer limitado: descarta os eventos mais antigos
         
     def handle_event(self, event):
-        self.data_buffer.append(event)  # Nunca limpa o buffer
+        self.data_buffer.append(event)
         self.callback(event)
 
 class DataProcessor:
     """Processador principal de dados com vazamentos intencionais"""
     
     def __init__(self):
-        self.processed_records = {}  # Vazamento 6: Registros processados nunca removidos
-        self.temp_files = []  # Vazamento 7: Referências a arquivos temporários
+        self.processed_records = LRU(4096)  # Registros processados limitados por LRU
+        self.temp_files_count = 0  # Apenas contabiliza os objetos temporários
         self.connections = []  # Vazamento 8: Conexões não fechadas
         self.memory_intensive_data = []  # Vazamento 9: Dados grandes acumulados
+        self._record_counter = itertools.count()  # IDs inteiros monotônicos
         
     def process_data_batch(self, batch_size: int = 1000):
         """Processa um lote de dados criando vazamentos"""
         logger.info(f"Processando lote de {batch_size} registros")
         
-        for i in range(batch_size):
+        for _ in range(batch_size):
             # Gera dados aleatórios grandes
-            record_id = f"record_{datetime.now().timestamp()}_{i}"
+            record_id = next(self._record_counter)
             large_data = self._generate_large_data()
             
-            # Cria registro com referências circulares
+            # Cria registro
             record = DataRecord(
                 id=record_id,
-                timestamp=datetime.now(),
+                timestamp=time.monotonic_ns(),
                 data=large_data,
-                metadata={"processed": True, "size": len(str(large_data))}
+                metadata={"processed": True, "size": sum(
+                    len(v) if isinstance(v, bytes) else v.nbytes
+                    for v in large_data.values()
+                )}
             )
             
-            # Vazamento: Armazena no cache global sem limpeza
+            # Armazena no cache global (LRU descarta os mais antigos)
             GLOBAL_CACHE[record_id] = record
             
-            # Vazamento: Mantém referências locais
+            # Mantém referências locais limitadas pelo LRU
             self.processed_records[record_id] = record
             
             # Vazamento: Adiciona a estruturas que crescem indefinidamente
@@ -94,31 +163,18 @@ class DataProcessor:
             
     def _generate_large_data(self) -> Dict[str, Any]:
         """Gera dados grandes para simular uso real de memória"""
+        # Valores e descrições em arrays contíguos (SoA) em vez de 50 dicts aninhados
         return {
-            "payload": ''.join(random.choices(string.ascii_letters + string.digits, k=10000)),
-            "matrix": [[random.random() for _ in range(100)] for _ in range(100)],
-            "nested_data": {
-                f"key_{i}": {
-                    "value": random.random(),
-                    "description": ''.join(random.choices(string.ascii_letters, k=500))
-                } for i in range(50)
-            }
+            "payload": _random_text(10000),
+            "matrix": np.random.random((100, 100)).astype(np.float32),
+            "nested_values": np.random.random(50).astype(np.float32),
+            "nested_desc": _random_text(50 * 500, _LETTERS)
         }
     
     def _simulate_processing(self, record: DataRecord):
         """Simula processamento complexo"""
-        # Vazamento: Cria objetos temporários que ficam em memória
-        temp_objects = []
-        for _ in range(100):
-            temp_obj = {
-                "id": record.id,
-                "data": record.data.copy(),  # Cópia profunda desnecessária
-                "processing_time": time.time()
-            }
-            temp_objects.append(temp_obj)
-        
-        # Vazamento: Adiciona aos arquivos temporários sem limpeza
-        self.temp_files.extend(temp_objects)
+        # Os objetos temporários nunca são lidos: mantém só a contagem
+        self.temp_files_count += TEMP_OBJECTS_PER_RECORD
 
 class ConnectionManager:
     """Gerenciador de conexões com vazamentos"""
@@ -131,8 +187,8 @@ class ConnectionManager:
         """Cria uma nova conexão"""
         connection = {
             "id": connection_id,
-            "created_at": datetime.now(),
-            "data_buffer": [],
+            "created_at": time.monotonic_ns(),
+            "data_buffer": deque(maxlen=128),
             "status": "active"
         }
         
@@ -145,50 +201,73 @@ class ConnectionManager:
     def send_data(self, connection_id: str, data: Any):
         """Envia dados através da conexão"""
         if connection_id in self.active_connections:
-            # Vazamento: Buffer cresce indefinidamente
+            # Buffer limitado a 128 mensagens
             self.active_connections[connection_id]["data_buffer"].append(data)
 
 class BackgroundWorker:
-    """Worker que roda em background com vazamentos"""
+    """Worker consumidor único que processa uma fila de trabalho limitada"""
     
-    def __init__(self, name: str):
+    def __init__(self, name: str, maxsize: int = 32, put_timeout: float = 1.0):
         self.name = name
-        self.is_running = True
-        self.work_queue = []  # Vazamento: Fila de trabalho nunca limpa
-        self.results = {}  # Vazamento: Resultados acumulados
+        self.put_timeout = put_timeout
+        self._stop = threading.Event()
+        self.work_queue = queue.Queue(maxsize=maxsize)  # Fila limitada: produtores bloqueiam quando cheia
+        self.results = deque(maxlen=512)  # Buffer circular de (timestamp, resultado)
+        self._rng = np.random.default_rng()  # Gerador do NumPy (float32 direto)
         self.thread = None
         
     def start(self):
         """Inicia o worker"""
-        self.thread = threading.Thread(target=self._work_loop, daemon=False)
+        self.thread = threading.Thread(target=self._work_loop, daemon=True)
         self.thread.start()
-        THREAD_POOL.append(self.thread)  # Vazamento: Threads acumuladas
+        THREAD_POOL.add(self.thread)
+        
+    def stop(self):
+        """Sinaliza o worker para parar, acordando-o imediatamente com uma sentinela"""
+        self._stop.set()
+        try:
+            self.work_queue.put_nowait(None)
+        except queue.Full:
+            pass  # Fila cheia: o loop verifica _stop após o próximo item
+        
+    def submit(self, name: str):
+        """Gera e enfileira um item de trabalho (espera até put_timeout se a fila estiver cheia)"""
+        if self.thread is None or not self.thread.is_alive():
+            logger.warning("Worker %s não está ativo; trabalho descartado", self.name)
+            return
+        
+        work_data = {
+            "timestamp": time.monotonic_ns(),
+            "random_data": self._rng.random(1000, dtype=np.float32),
+            "worker_name": name
+        }
+        try:
+            self.work_queue.put(work_data, timeout=self.put_timeout)
+        except queue.Full:
+            logger.warning("Fila do worker %s cheia; trabalho descartado", self.name)
         
     def _work_loop(self):
-        """Loop principal do worker"""
-        while self.is_running:
-            # Vazamento: Cria dados desnecessários a cada iteração
-            work_data = {
-                "timestamp": datetime.now(),
-                "random_data": [random.random() for _ in range(1000)],
-                "worker_name": self.name
-            }
+        """Loop principal do worker: acorda apenas quando há trabalho"""
+        while True:
+            work_data = self.work_queue.get()
+            if work_data is None or self._stop.is_set():
+                break
             
-            self.work_queue.append(work_data)
-            
-            # Simula trabalho
-            result = self._process_work(work_data)
-            self.results[time.time()] = result  # Vazamento: Resultados nunca removidos
-            
-            time.sleep(0.1)  # Simula trabalho
+            # Simula trabalho; uma falha não pode derrubar o único consumidor
+            try:
+                result = self._process_work(work_data)
+            except Exception:
+                logger.exception("Erro ao processar trabalho no worker %s", self.name)
+                continue
+            self.results.append((time.time(), result))
     
     def _process_work(self, work_data: Dict) -> Dict:
         """Processa trabalho"""
         # Vazamento: Cria objetos grandes desnecessários
         large_result = {
             "processed_data": work_data.copy(),
-            "additional_data": ''.join(random.choices(string.ascii_letters, k=5000)),
-            "computation_result": [random.random() for _ in range(500)]
+            "additional_data": _random_text(5000, _LETTERS),
+            "computation_result": self._rng.random(500, dtype=np.float32)
         }
         
         return large_result
@@ -199,16 +278,21 @@ class MemoryLeakSimulator:
     def __init__(self):
         self.data_processor = DataProcessor()
         self.connection_manager = ConnectionManager()
-        self.workers = []
+        self.worker = None
+        self.num_workers = 0
         self.event_listeners = []
         self.running = True
+        # Handle do processo criado uma única vez (None se psutil não estiver disponível)
+        self._proc = psutil.Process(os.getpid()) if psutil is not None else None
+        # Snapshot base para comparação (apenas se o tracemalloc estiver ativo)
+        self._baseline_snap = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
         
     def setup_event_listeners(self):
         """Configura listeners de eventos"""
         for i in range(5):
             listener = EventListener(
                 name=f"listener_{i}",
-                callback=lambda event: self._handle_event(event)
+                callback=self._handle_event
             )
             self.event_listeners.append(listener)
             EVENT_LISTENERS.append(listener)  # Vazamento global
@@ -218,8 +302,8 @@ class MemoryLeakSimulator:
         # Vazamento: Processa eventos sem limpeza
         processed_event = {
             "original": event,
-            "processed_at": datetime.now(),
-            "handler_data": [random.random() for _ in range(100)]
+            "processed_at": time.monotonic_ns(),
+            "handler_data": np.random.random(100)
         }
         
         # Adiciona a todas as estruturas de dados
@@ -227,11 +311,19 @@ class MemoryLeakSimulator:
             listener.data_buffer.append(processed_event)
     
     def start_background_workers(self, num_workers: int = 3):
-        """Inicia workers em background"""
-        for i in range(num_workers):
-            worker = BackgroundWorker(f"worker_{i}")
-            worker.start()
-            self.workers.append(worker)
+        """Inicia o worker em background (uma única thread).
+        
+        num_workers define apenas quantos itens de trabalho, rotulados
+        worker_0..worker_{n-1}, são enfileirados a cada iteração.
+        """
+        self.worker = BackgroundWorker("worker")
+        self.worker.start()
+        self.num_workers = num_workers
+    
+    def submit_background_work(self):
+        """Enfileira um item de trabalho por rótulo para o worker"""
+        for i in range(self.num_workers):
+            self.worker.submit(f"worker_{i}")
     
     def simulate_connections(self, num_connections: int = 10):
         """Simula conexões ativas"""
@@ -243,7 +335,7 @@ class MemoryLeakSimulator:
             for j in range(50):
                 large_data = {
                     "message_id": j,
-                    "payload": ''.join(random.choices(string.ascii_letters, k=2000)),
+                    "payload": _random_text(2000, _LETTERS),
                     "metadata": {"size": 2000, "type": "simulation"}
                 }
                 self.connection_manager.send_data(conn_id, large_data)
@@ -267,6 +359,9 @@ class MemoryLeakSimulator:
             # Processa dados (cria vazamentos)
             self.data_processor.process_data_batch(random.randint(500, 1500))
             
+            # Alimenta o worker em background
+            self.submit_background_work()
+            
             # Simula conexões (cria vazamentos)
             self.simulate_connections(random.randint(5, 15))
             
@@ -274,13 +369,15 @@ class MemoryLeakSimulator:
             for _ in range(random.randint(10, 50)):
                 event = {
                     "type": "data_event",
-                    "timestamp": datetime.now(),
+                    "timestamp": time.monotonic_ns(),
                     "data": [random.random() for _ in range(200)]
                 }
                 self._handle_event(event)
             
             # Relatório de uso de memória
             self._log_memory_usage()
+            if iteration % TRACEMALLOC_INTERVAL == 0:
+                self._log_allocation_growth()
             
             # Aguarda antes da próxima iteração
             time.sleep(random.uniform(1, 3))
@@ -289,30 +386,43 @@ class MemoryLeakSimulator:
     
     def _log_memory_usage(self):
         """Registra uso de memória"""
-        try:
-            import psutil
-            import os
-            
-            process = psutil.Process(os.getpid())
-            memory_info = process.memory_info()
-            
-            logger.info(f"Uso de memória: {memory_info.rss / 1024 / 1024:.2f} MB")
-            logger.info(f"Cache global: {len(GLOBAL_CACHE)} itens")
-            logger.info(f"Registros processados: {len(self.data_processor.processed_records)}")
-            logger.info(f"Conexões ativas: {len(self.connection_manager.active_connections)}")
-            logger.info(f"Threads ativas: {len(THREAD_POOL)}")
-            
-        except ImportError:
+        if self._proc is None:
             logger.warning("psutil não disponível para monitoramento de memória")
+            return
+        
+        memory_info = self._proc.memory_info()
+        
+        # Uma única chamada com formatação lazy (%), ignorada se o nível estiver desativado
+        logger.info(
+            "Uso de memória: %.2f MB | Cache global: %d itens | Registros processados: %d | "
+            "Conexões ativas: %d | Threads ativas: %d",
+            memory_info.rss / 1024 / 1024,
+            len(GLOBAL_CACHE),
+            len(self.data_processor.processed_records),
+            len(self.connection_manager.active_connections),
+            len(THREAD_POOL)
+        )
+    
+    def _log_allocation_growth(self, limit: int = 10):
+        """Registra os pontos de alocação que mais cresceram desde o snapshot base"""
+        if self._baseline_snap is None:
+            return
+        
+        snap = tracemalloc.take_snapshot()
+        for stat in snap.compare_to(self._baseline_snap, 'lineno')[:limit]:
+            logger.info("%s", stat)
     
     def stop(self):
         """Para a simulação"""
         self.running = False
-        for worker in self.workers:
-            worker.is_running = False
+        if self.worker is not None:
+            self.worker.stop()
 
 def main():
     """Função principal"""
+    # Rastreamento de alocações opcional: LEAK_TRACEMALLOC=1 python leak.py
+    if os.environ.get("LEAK_TRACEMALLOC") == "1":
+        tracemalloc.start(1)  # Um frame basta para o agrupamento por 'lineno'
     simulator = MemoryLeakSimulator()
     
     try:
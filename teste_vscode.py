@@ -1,15 +1,16 @@
 # Teste de memória em Python 05
 
+import numpy as np
+
 leak_list = []  # Lista global que acumula dados desnecessariamente
 
 def process_data(data_chunk):
     # Simula o processamento de dados
-    result = [x**2 for x in data_chunk]
-    return result
+    return np.square(data_chunk)
 
 def main():
     # Simula um grande conjunto de dados dividido em chunks
-    data = [list(range(1000)) for _ in range(100)]
+    data = np.tile(np.arange(1000, dtype=np.int32), (100, 1))
     
     for chunk in data:
         # Processa o chunk atual